@@ -13,6 +13,9 @@ import smtplib as s
 from twilio.rest import Client
 import pygame
 import sys
+import queue
+import threading
+import atexit
 
 # Add the path of modules folder to sys.path
 sys.path.append('./modules')
@@ -23,10 +26,33 @@ import keys
 # Initialize pygame for audio play
 pygame.init()
 
+# Decode the audio clips once at startup and play them on one channel, so a new
+# clip replaces the one that is playing just like pygame.mixer.music did.
+# Loading MP3 files as Sounds needs pygame 2 built with MP3 support. Without a
+# working mixer the monitoring keeps running with the audio switched off.
+sounds = {}
+audio_channel = None
+try:
+    for name in ["ok", "Divert", "CCTV", "monitored", "off"]:
+        sounds[name] = pygame.mixer.Sound(f"audio/{name}.mp3")
+    audio_channel = pygame.mixer.Channel(0)
+except Exception as e:
+    print("Audio disabled, could not load the alert sounds:", e)
+
+# Play one of the preloaded clips
+def play_audio(name):
+    if audio_channel is not None:
+        audio_channel.play(sounds[name])
+
+# Check whether a clip is still playing
+def audio_busy():
+    return audio_channel is not None and audio_channel.get_busy()
+
+# Create the Twilio client once so every SMS reuses its HTTP session
+client = Client(keys.account_sid, keys.auth_token)
+
 # Function to send Normal SMS to the farmer
 def sending_sms_farmer():
-    client = Client(keys.account_sid, keys.auth_token)
-
     message = client.messages.create(
         body = "Alert! Your Farm is under the attack of normal animals.",
         from_ = keys.twilio_number,
@@ -35,8 +61,6 @@ def sending_sms_farmer():
 
 # Function to send Danger SMS to the farmer
 def sending_sms_farmer_danger():
-    client = Client(keys.account_sid, keys.auth_token)
-
     message = client.messages.create(
         body = "Alert! Your Farm is under the attack of dangerous animals. Please wait and don't go to farm until the forest team come for help",
         from_ = keys.twilio_number,
@@ -45,8 +69,6 @@ def sending_sms_farmer_danger():
 
 # Function to send Forgery SMS to the farmer
 def sending_sms_farmer_forgery():
-    client = Client(keys.account_sid, keys.auth_token)
-
     message = client.messages.create(
         body = "Alert! Someone is so close to the camera. There might be security breech. Please look out!!.",
         from_ = keys.twilio_number,
@@ -55,31 +77,75 @@ def sending_sms_farmer_forgery():
 
 # Function to send Forgery SMS to the farmer
 def sending_sms_farmer_sys_forgery():
-    client = Client(keys.account_sid, keys.auth_token)
-
     message = client.messages.create(
         body = "Alert! Someone has stopped your CCTV Monitoring. There might be security breech. Please look out!!.",
         from_ = keys.twilio_number,
         to = keys.target_number
         )
 
+# The forest officer message only depends on the farmer's number, so build it once
+FOREST_MESSAGE = "Alert! There is a wild animal in the area. Please contact the farmer " + str(keys.target_number)
+
 # Function to send SMS to the forest officer
 def sending_sms_forest():
-    client = Client(keys.account_sid, keys.auth_token)
-    mess = "Alert! There is a wild animal in the area. Please contact the farmer " + str(keys.target_number)
     message = client.messages.create(
-        body = mess,
+        body = FOREST_MESSAGE,
         from_ = keys.twilio_number,
         to = keys.forest_number
         )
 
+# Alerts are sent from worker threads so the SMS network calls never stall the
+# camera loop. Several workers let the farmer and forest SMS go out at the same
+# time. Repeats of the same alert inside the window are dropped.
+ALERT_SUPPRESS_SECONDS = 30
+ALERT_WORKERS = 4
+ALERT_FLUSH_SECONDS = 30
+alert_q = queue.Queue(maxsize=100)
+last_alert_time = {}
+
+def alert_worker():
+    while True:
+        send = alert_q.get()
+        try:
+            send()
+        except Exception as e:
+            print("Failed to send alert:", e)
+        finally:
+            alert_q.task_done()
+
+def queue_alert(send):
+    now = time.monotonic()
+    last = last_alert_time.get(send)
+    if last is not None and now - last < ALERT_SUPPRESS_SECONDS:
+        return
+    last_alert_time[send] = now
+    try:
+        alert_q.put_nowait(send)
+    except queue.Full:
+        print("Alert queue is full, dropping alert")
+
+# Wait for queued alerts to go out before the program exits, so an alert raised
+# just before shutdown is not lost with the daemon workers
+def flush_alerts():
+    deadline = time.monotonic() + ALERT_FLUSH_SECONDS
+    while alert_q.unfinished_tasks > 0:
+        if time.monotonic() >= deadline:
+            print("Gave up waiting for", alert_q.unfinished_tasks, "queued alerts")
+            return
+        time.sleep(0.1)
+
+for _ in range(ALERT_WORKERS):
+    threading.Thread(target=alert_worker, daemon=True).start()
+# also flush when the loop dies with an exception
+atexit.register(flush_alerts)
+
 # classify frame using classify function
 def classify(frame):
     img = cv2.resize(frame, (224, 224))
     #img = cv2.resize(frame, (180, 180))
     x = image.img_to_array(img)
     x = np.expand_dims(x, axis=0)
-    pred = model.predict(x, batch_size=32)[0]
+    pred = infer(x)[0]
     #x = np.expand_dims(img, axis=0)
     #pred = model.predict(x)[0]
     label = classes[np.argmax(pred)]
@@ -92,14 +158,13 @@ def classify(frame):
 # classify frame using predict_class function
 def predict_class(frame):
 
-    # load the image for prediction
-    img = cv2.resize(frame, (224, 224))
-    x = image.img_to_array(img)
-    x = np.expand_dims(x, axis=0)
-    x /= 255.
+    # resize and scale the frame straight into the preallocated input buffers
+    cv2.resize(frame, (224, 224), dst=resize_buf)
+    np.multiply(resize_buf, 1 / 255., out=input_buf[0])
+    x = input_buf
 
     # make the prediction
-    preds = model.predict(x)
+    preds = infer(x)
     p = str(preds[0])[1:-5]
     #d_p = float(p)
     if preds[0] > 0.78:
@@ -126,13 +191,90 @@ def distan(frame, detector):
     return 0
 
 
-# load the saved model
-model = load_model('models/Functional/my_model_3.h5')
+# Reused for every frame so predict_class does not allocate new input arrays
+resize_buf = np.empty((224, 224, 3), dtype=np.uint8)
+input_buf = np.zeros((1, 224, 224, 3), dtype=np.float32)
+
+# Prefer the INT8 model built by modules/quantize.py when it is available
+MODEL_PATH = 'models/Functional/my_model_3.h5'
+INT8_MODEL_PATH = 'models/Functional/my_model_3_int8.tflite'
+if os.path.exists(INT8_MODEL_PATH):
+    print("Using the INT8 TFLite model", INT8_MODEL_PATH)
+    if os.path.exists(MODEL_PATH) and os.path.getmtime(INT8_MODEL_PATH) < os.path.getmtime(MODEL_PATH):
+        print("Warning:", INT8_MODEL_PATH, "is older than", MODEL_PATH + ", rebuild it with `python modules/quantize.py`")
+    interpreter = tf.lite.Interpreter(model_path=INT8_MODEL_PATH)
+    interpreter.allocate_tensors()
+    input_index = interpreter.get_input_details()[0]['index']
+    output_index = interpreter.get_output_details()[0]['index']
+
+    def infer(x):
+        interpreter.set_tensor(input_index, x)
+        interpreter.invoke()
+        return interpreter.get_tensor(output_index)
+else:
+    # load the saved model
+    model = load_model(MODEL_PATH)
+
+    # Trace the forward pass once for a fixed (1, 224, 224, 3) input so every frame
+    # runs the compiled graph instead of going through model.predict(). XLA fuses
+    # the layers into a few kernels so each frame pays far fewer launches.
+    input_signature = [tf.TensorSpec(shape=(1, 224, 224, 3), dtype=tf.float32)]
+
+    @tf.function(input_signature=input_signature, jit_compile=True)
+    def forward(x):
+        return model(x, training=False)
+
+    # Compile once at startup so the first camera frame does not stall, and fall
+    # back to the plain graph when XLA cannot compile the model on this build
+    try:
+        forward(input_buf)
+        print("Using the Keras model", MODEL_PATH, "with XLA")
+    except Exception as e:
+        print("XLA compile failed, using the Keras model", MODEL_PATH, "without XLA:", e)
+
+        @tf.function(input_signature=input_signature)
+        def forward(x):
+            return model(x, training=False)
+
+        forward(input_buf)
+
+    def infer(x):
+        return forward(x).numpy()
 
 # define the class labels
 classes =  ['Danger', 'Not Danger']
 # initialize camera
 cap = cv2.VideoCapture(0)
+# keep only the newest frame in the driver queue so a slow loop never works on stale frames
+cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+# Read the camera on its own thread so grabbing the next frame overlaps with
+# processing the current one. Each read returns a new array, so the newest one
+# is handed over by reference and taken at most once.
+latest_frame = None
+capture_ok = True
+frame_ready = threading.Condition()
+
+def capture_worker():
+    global latest_frame, capture_ok
+    while capture_ok:
+        ret, f = cap.read()
+        with frame_ready:
+            if ret:
+                latest_frame = f
+            else:
+                capture_ok = False
+            frame_ready.notify()
+
+def read_frame():
+    global latest_frame
+    with frame_ready:
+        while latest_frame is None and capture_ok:
+            frame_ready.wait()
+        frame = latest_frame
+        latest_frame = None
+    return frame is not None, frame
+
 detector = FaceMeshDetector(maxFaces=1)
 
 # set the window name and size
@@ -155,25 +297,52 @@ count2 = 1
 count3 = 0
 count4 = 0
 flag=0
+DETECT_EVERY = 3
+frame_idx = 0
+faces = []
+bodies = []
 
 # Create a directory for saving recorded videos
 if not os.path.exists("recording"):
     os.makedirs("recording")
-s_time = time.time()
+s_time = time.perf_counter()
+time_sec = None
+time_text = ""
+capture_thread = threading.Thread(target=capture_worker, daemon=True)
+capture_thread.start()
 # loop to capture and classify video frames
 while True:
     # read frame from camera
-    ret, frame = cap.read()
+    ret, frame = read_frame()
+    if not ret:
+        # the capture thread has stopped, so monitoring cannot continue
+        print("Camera stopped sending frames, monitoring has ended")
+        queue_alert(sending_sms_farmer_sys_forgery)
+        if detection:
+            out.release()
+        break
+    # read the clock once and use it for every interval check on this frame
+    now = time.perf_counter()
     
-    # draw the label and date-time on the frame
-    y= datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cv2.putText(frame, "TIME:  " + str(y) , (10, 25), cv2.FONT_HERSHEY_PLAIN, 1.3, (0,255,0) , 1)
+    # draw the label and date-time on the frame, rebuilding the text only when the second changes
+    sec = int(time.time())
+    if sec != time_sec:
+        time_sec = sec
+        time_text = "TIME:  " + datetime.datetime.fromtimestamp(sec).strftime("%Y-%m-%d %H:%M:%S")
+    cv2.putText(frame, time_text, (10, 25), cv2.FONT_HERSHEY_PLAIN, 1.3, (0,255,0) , 1)
     
     
     # Object Detection and recording
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    faces = face_cascade.detectMultiScale(gray, 1.3, 5)
-    bodies = body_cascade.detectMultiScale(gray, 1.3, 5)
+    # Run the cascades every DETECT_EVERY frames and reuse the last boxes in between
+    if frame_idx % DETECT_EVERY == 0:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        faces = face_cascade.detectMultiScale(gray, 1.3, 5)
+        # The full-body cascade is only needed when no face was found
+        if len(faces) > 0:
+            bodies = []
+        else:
+            bodies = body_cascade.detectMultiScale(gray, 1.3, 5)
+    frame_idx += 1
     if len(faces) + len(bodies) > 0:
         if detection:
             timer_started = False
@@ -182,43 +351,42 @@ while True:
             current_time = datetime.datetime.now().strftime("%d-%m-%Y-%H-%M-%S")
             out = cv2.VideoWriter(os.path.join("recording", f"{current_time}.mp4"), fourcc, 20, frame_size)
             #os.system("ok.mp3")
-            pygame.mixer.music.load("audio/ok.mp3")
-            pygame.mixer.music.play()
+            play_audio("ok")
             #sending_mail()
             print("Started Recording!")
             time.sleep(1)
     elif detection:
         if timer_started:
-            if time.time() - detection_stopped_time >= SECONDS_TO_RECORD_AFTER_DETECTION:
+            if now - detection_stopped_time >= SECONDS_TO_RECORD_AFTER_DETECTION:
                 detection = False
                 count = 1
                 count1 = 1
                 count2 = 1
                 count3 = 0
                 count4 = 0
-                s_time = time.time()
+                s_time = now
                 timer_started = False
                 out.release()
                 print('Stop Recording!')
         else:
             timer_started = True
-            detection_stopped_time = time.time()
+            detection_stopped_time = now
+
+    # Classify the frame and measure the distance once, then reuse the results
+    # for the alerts and the overlay
+    string, pred = predict_class(frame)
+    dis = distan(frame, detector)
 
     if detection:
         
         #string, conf = classify(frame)
-        string, pred = predict_class(frame)
         
-        dis = distan(frame, detector)
-        
-        current_time = time.time()
-        elapsed_time = current_time - s_time
+        elapsed_time = now - s_time
 
         if elapsed_time >= 10:
             count3 = 0
             count4 = 0
-            s_time = current_time
-        print("Danger Count -----> ",count3, " <========> Not Danger Count -----> ", count4)
+            s_time = now
         
         if(string=="Danger"):
             count3+=1
@@ -227,29 +395,26 @@ while True:
         
         if(count3>count4 and count3>=15 and flag==0):
             if(count==1):
-                sending_sms_farmer_danger()
-                sending_sms_forest()
+                queue_alert(sending_sms_farmer_danger)
+                queue_alert(sending_sms_forest)
                 count=0
             flag=1
             print("Playing Divert Sound")
-            pygame.mixer.music.load("audio/Divert.mp3")
-            pygame.mixer.music.play()
+            play_audio("Divert")
         elif(dis<=30 and flag==0):
             if(count2==1):
-                sending_sms_farmer_forgery()
+                queue_alert(sending_sms_farmer_forgery)
                 count2 = 0
-            pygame.mixer.music.load("audio/CCTV.mp3")
-            pygame.mixer.music.play()
+            play_audio("CCTV")
             flag=1
         elif(30<dis<=50 and flag==0):
             if(count1==1):
-                sending_sms_farmer()
+                queue_alert(sending_sms_farmer)
                 count1 = 0
-            pygame.mixer.music.load("audio/monitored.mp3")
-            pygame.mixer.music.play()
+            play_audio("monitored")
             flag=1
         
-        if not pygame.mixer.music.get_busy():
+        if not audio_busy():
             flag = 0
         out.write(frame)
 
@@ -261,15 +426,13 @@ while True:
     #text1 = label + ' ({:.1f}%)'.format(confidence)
     #cv2.putText(frame, text1, (220, 350), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 255), 2)
     
-    # Call the predict_class function and find the danger level
-    string, pred = predict_class(frame)
+    # Draw the danger level found by predict_class
     text1 = string +  " : " + pred + " %"
     cv2.putText(frame, text1, (220, 350), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 255), 2)
     
     
-    # Call the distan function and find the distance of the object
-    d = distan(frame, detector)
-    text2 = 'Distance: ' + str(int(d)) + ' cm'
+    # Draw the distance of the object found by distan
+    text2 = 'Distance: ' + str(int(dis)) + ' cm'
     cv2.putText(frame, text2, (430, 25), cv2.FONT_HERSHEY_PLAIN, 1.5, (102, 102, 255), 2)
     
     # show frame in the window
@@ -277,15 +440,16 @@ while True:
 
     # break the loop if 'q' key is pressed
     if cv2.waitKey(1) & 0xFF == ord('q'):
-        pygame.mixer.music.load("audio/off.mp3")
-        pygame.mixer.music.play()
+        play_audio("off")
         sending_sms_farmer_sys_forgery()
         out.release()
         time.sleep(6)
         break
-    time.sleep(0.01)
 
-# release camera and close windows
+# send any alerts still queued, then release camera and close windows
+flush_alerts()
 pygame.quit()
+capture_ok = False
+capture_thread.join()
 cap.release()
 cv2.destroyAllWindows()
\ No newline at end of file
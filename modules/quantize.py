@@ -0,0 +1,68 @@
+# Post-training INT8 quantization of the danger classifier for CPU / edge boards
+#
+# Collect calibration frames from the camera:  python modules/quantize.py collect
+# Build the INT8 TFLite model:                 python modules/quantize.py
+import cv2
+import numpy as np
+import tensorflow as tf
+from keras.models import load_model
+import os
+import sys
+import time
+
+MODEL_PATH = 'models/Functional/my_model_3.h5'
+INT8_MODEL_PATH = 'models/Functional/my_model_3_int8.tflite'
+CALIB_DIR = 'calib'
+CALIB_FRAMES = 300
+
+# Save frames from the camera into the calibration folder
+def collect_frames():
+    cap = cv2.VideoCapture(0)
+    if not cap.isOpened():
+        print("Could not open the camera, no calibration frames collected")
+        return
+    if not os.path.exists(CALIB_DIR):
+        os.makedirs(CALIB_DIR)
+    saved = 0
+    while saved < CALIB_FRAMES:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        cv2.imwrite(os.path.join(CALIB_DIR, f"{saved:04d}.jpg"), frame)
+        saved += 1
+        # space the samples out so they are not near-duplicates
+        time.sleep(0.1)
+    cap.release()
+    print("Saved", saved, "calibration frames to", CALIB_DIR)
+
+# Feed calibration frames with the same preprocessing as predict_class in main.py
+def representative_dataset():
+    for name in sorted(os.listdir(CALIB_DIR))[:CALIB_FRAMES]:
+        img = cv2.imread(os.path.join(CALIB_DIR, name))
+        if img is None:
+            continue
+        img = cv2.resize(img, (224, 224))
+        x = np.expand_dims(img.astype(np.float32) / 255., axis=0)
+        yield [x]
+
+# Convert the Keras model to an INT8 TFLite model, keeping float input and output
+def quantize():
+    if not os.path.isdir(CALIB_DIR) or not os.listdir(CALIB_DIR):
+        print("No calibration frames in", CALIB_DIR + ", run `python modules/quantize.py collect` first")
+        return
+    model = load_model(MODEL_PATH)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    tflite_model = converter.convert()
+    with open(INT8_MODEL_PATH, 'wb') as f:
+        f.write(tflite_model)
+    print("Saved INT8 model to", INT8_MODEL_PATH)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'collect':
+        collect_frames()
+    else:
+        quantize()